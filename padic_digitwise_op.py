@@ -5,7 +5,8 @@
 # - d being the positive integer denominator.
 #
 # A p-adic number is represented as the tuple (seq, rpt, shr) with
-# - seq being a sequence of digits in [0, p),
+# - seq being a sequence of digits in [0, p), stored as a bytearray when
+#   p <= 256 (one byte per digit) and as a list of ints otherwise,
 # - rpt being the "repeat index" (which index to cycle back to after hitting
 #   the end of the sequence), and
 # - shr being non-negative right-shift of seq[0] (essentially how many digits
@@ -16,111 +17,215 @@
 import string
 import random
 import math
+import functools
+import itertools
+import operator
 
 # symbols to use to represent digits
 syms = string.digits + string.ascii_lowercase
 
-# Miller-Rabin primality test
-def is_probably_prime(n, k=1000):
-    if n <= 3:
-        return n > 1
-    elif n % 2 == 0:
+# bytes.translate table mapping a digit value to the byte of its symbol. digits
+# with no symbol map to 0xff, which is not ascii, so decoding fails on them
+# instead of printing something made up.
+sym_table = syms.encode().ljust(256, b"\xff")
+
+# deterministic Miller-Rabin witnesses for n < 3317044064679887385961981
+mr_witnesses = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# primes below 1000 for trial division
+small_primes = tuple(
+    i for i in range(2, 1000) if all(i % j for j in range(2, math.isqrt(i) + 1))
+)
+
+# gaps between consecutive numbers coprime to 2*3*5*7 = 210, starting at 11.
+# these repeat every 210, so cycling through them from 11 + 210 * m skips all
+# multiples of 2, 3, 5 and 7.
+wheel_spokes = [i for i in range(11, 11 + 210 + 1) if math.gcd(i, 210) == 1]
+wheel_gaps = tuple(b - a for a, b in zip(wheel_spokes, wheel_spokes[1:]))
+# where in wheel_gaps to start so that the wheel picks up at 1009, the first
+# number coprime to 210 past the small primes below.
+wheel_start = wheel_spokes.index(1009 - 210 * 4)
+
+# Miller-Rabin primality test. the same p gets checked over and over when
+# this is used as a library, so remember the answers.
+@functools.lru_cache(maxsize=1024)
+def is_probably_prime(n, k=25):
+    if n < 2:
         return False
+    # trial division by the small primes first. this settles all n < 1000^2
+    # and weeds out most composites before we do any modular exponentiation.
+    for q in small_primes:
+        if q * q > n:
+            return True
+        if n % q == 0:
+            return n == q
+    # keep going with the numbers coprime to 2*3*5*7 up to a small limit,
+    # starting right after the last of the small primes (997).
+    q = 1009
+    for gap in itertools.islice(itertools.cycle(wheel_gaps), wheel_start, None):
+        if q * q > n:
+            return True
+        if q > 10000:
+            break
+        if n % q == 0:
+            return False
+        q += gap
+    d, s = n - 1, 0
+    # compute s and odd d such that 2^s * d = n - 1
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    if n < 3317044064679887385961981:
+        # the first 13 primes (2 through 41) are known to be enough
+        # witnesses to make the test deterministic below this bound. the
+        # first 12 only go up to 318665857834031151167461.
+        witnesses = mr_witnesses
     else:
-        d, s = n - 1, 0
-        # compute s and odd d such that 2^s * d = n - 1
-        while d % 2 == 0:
-            d //= 2
-            s += 1
-        for _ in range(k):
-            a = random.randint(2, n - 2)
-            x = pow(a, d, n)
-            # if a^d is 1 or -1 (mod n), it's useless to us
-            if x == 1 or x == n - 1:
-                continue
-            for _ in range(0, s - 1):
-                x = pow(x, 2, n)
-                # x^2 = 1 (mod n) implies x = 1 or x = -1 (mod n) for all x
-                # when n is prime, but we know that x was not 1 or -1 (mod n)
-                # before squaring it.
-                if x == 1:
-                    return False
-                # if x^2 = -1, we can't learn much because after this we just
-                # get (-1)^2 = 1 which holds regardless of primality.
-                if x == n - 1:
-                    break
-            # at this point, we took our original a^d and squared it s-1 times
-            # to get a^(d * 2^(s-1)). squaring it once more gets a^(d * 2^s)
-            # which is a^(p-1).
-            # Fermat's little theorem: x^(p-1) = 1 (mod n) for all x when n is
-            # prime.
-            if pow(x, 2, n) != 1:
+        # each random witness lets a composite through with probability at
+        # most 1/4, so k = 25 rounds already leave less than a 2^-50 chance.
+        witnesses = (random.randint(2, n - 2) for _ in range(k))
+    for a in witnesses:
+        x = pow(a, d, n)
+        # if a^d is 1 or -1 (mod n), it's useless to us
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(0, s - 1):
+            x = pow(x, 2, n)
+            # x^2 = 1 (mod n) implies x = 1 or x = -1 (mod n) for all x
+            # when n is prime, but we know that x was not 1 or -1 (mod n)
+            # before squaring it.
+            if x == 1:
                 return False
+            # if x^2 = -1, we can't learn much because after this we just
+            # get (-1)^2 = 1 which holds regardless of primality.
+            if x == n - 1:
+                break
+        else:
+            # at this point, we took our original a^d and squared it s-1
+            # times to get a^(d * 2^(s-1)) without ever hitting -1.
+            # squaring it once more gets a^(d * 2^s) which is a^(p-1).
+            # Fermat's little theorem says that must be 1 (mod n) when n
+            # is prime, and since x is not -1 (mod n), x must be a
+            # non-trivial square root of 1, which is impossible mod a
+            # prime.
+            return False
     return True
 
-def padic_from_rational(rat, p=2):
-    n, d = rat
-    # we want n / d = padic, i.e. n - padic * d = 0. this is acheived by
-    # solving the equation for the padic mod p^k, one power of p at a time.
-    seq = []
-    seen = {}
-    shr = 0
-    # first let's make gcd(d, p) = 1
-    while d % p == 0:
-        d //= p
-        if n % p == 0:
-            # this simplification step helps us avoid unnecessary trailing
-            # zeroes
-            n //= p
-        else:
-            # we're removing a p-factor in d but not in n, so we need to shift
-            # the resulting padic to have the same effect of dividing it by p.
-            shr += 1
-    di = pow(d, -1, p)
+# the inverse of x mod p. there are only p - 1 possible x for each p, so this
+# is worth remembering across calls.
+@functools.lru_cache(maxsize=1024)
+def modinv(x, p):
+    return pow(x, -1, p)
+
+def valuation(x, p):
+    # the number of times p divides the non-zero integer x
+    if p == 2:
+        # the lowest set bit of x is the largest power of two dividing it
+        return (x & -x).bit_length() - 1
+    # find the powers p, p^2, p^4, p^8, ... that divide x. the valuation is
+    # then less than twice the last one, so we can fill in its binary digits
+    # from the top down, dividing out each power that still fits.
+    pows = []
+    pk = p
+    while x % pk == 0:
+        pows.append(pk)
+        pk *= pk
+    v = 0
+    for i in reversed(range(len(pows))):
+        if x % pows[i] == 0:
+            x //= pows[i]
+            v += 1 << i
+    return v
+
+def padic_core(n, d, di, p):
     # induction on k: want to preserve n - curr_padic * d = 0 (mod p^k)
     # - we'll just store (n - curr_padic * d) / (p^k) as our state in "n"
     # - we want to add a digit to curr_padic to solve that initial congruence
     #   mod p^(k+1).
     #   - we can do this by adding a digit to seq in the p^k place, namely our
-    #     current "n" state times the modular multiplicative inverse of "d".
-    # - if we come across an "n" state we have seen before, we know the future
-    #   outcomes will be the same, so we found our repeat index.
-    while n not in seen:
-        # store the repeat index len(seq) for the state value n for future use
-        seen[n] = len(seq)
+    #     current "n" state times the modular multiplicative inverse of "d"
+    #     (that's "di").
+    # - the state n / d is exactly the value of the digits still to come. a
+    #   p-adic expansion is purely periodic iff its value lies in [-1, 0], so
+    #   the states on the cycle are exactly those with -d <= n <= 0. the
+    #   repeat index is where we first land in that range, and the period
+    #   ends when we get back to the same state. no need to remember all the
+    #   states we have seen, and unlike a generic cycle finder (Floyd, Brent)
+    #   we never step through the sequence twice: each digit is computed
+    #   exactly once and the only memory is seq itself.
+    seq = bytearray() if p <= 256 else []
+    # this loop runs once per digit, so avoid the attribute lookup each time
+    append = seq.append
+    while n > 0 or n < -d:
         # i is the digit we need to add to solve the congruence
         i = (n * di) % p
-        seq.append(i)
+        append(i)
         # update the state n with the new digit in the padic, making it now
-        # congruent to zero mod p.
-        n -= d * i
-        # divide the state by p to setup for next iteration
-        n //= p
-    return seq, seen[n], shr
+        # congruent to zero mod p, then divide the state by p to setup for
+        # the next iteration.
+        n = (n - d * i) // p
+    rpt, start = len(seq), n
+    while True:
+        i = (n * di) % p
+        append(i)
+        n = (n - d * i) // p
+        if n == start:
+            return seq, rpt
+
+def padic_from_rational(rat, p=2):
+    n, d = rat
+    # padic_core relies on d being positive, so move the sign to n.
+    if d < 0:
+        n, d = -n, -d
+    # we want n / d = padic, i.e. n - padic * d = 0. this is acheived by
+    # solving the equation for the padic mod p^k, one power of p at a time.
+    # first let's make gcd(d, p) = 1. we strip all the p-factors in d at once,
+    # and as many p-factors from n as we can to avoid unnecessary trailing
+    # zeroes. any p-factors of d that are left over, we need to shift the
+    # resulting padic by to have the same effect of dividing it by p.
+    v_d = valuation(d, p)
+    v_n = valuation(n, p) if n else v_d
+    shr = max(v_d - v_n, 0)
+    n //= pow(p, v_d - shr)
+    d //= pow(p, v_d)
+    seq, rpt = padic_core(n, d, modinv(d % p, p), p)
+    return seq, rpt, shr
 
 def rational_from_padic(padic, p=2):
     seq, rpt, shr = padic
-    # "k" keeps track of the power of p for the current digit
-    a, c, k = 0, 0, 1
-    # accumulate the non-repeating digits into an integer "a"
-    for i in range(rpt):
-        a += seq[i] * k
-        k *= p
-    # for the repeating digits, we can use the geometric series formula:
-    #   c + c * r + c * r^2 ... = c / (1 - r).
-    # if the repeating part repeats with period t, and has a value of c in the
-    # first iteration, then it's equal to
-    #   c + c * p^t + c * p^2t ...
-    # so we apply the geometric series formula with c = c and r = p^t to get
-    #   c / (1 - p^t).
-    for i in range(rpt, len(seq)):
-        c += seq[i] * k
-        k *= p
     # we can apply shr by just multiplying by p^-shr. finally, the number is
     # (a + c / (1 - p^t)) * p^-shr which expands into a fraction as
     # (a * (p^t - 1) - c) / ((p^t - 1) * p^shr)
-    d = pow(p, len(seq) - rpt) - 1 # d = p^t - 1
-    return a * d - c, d * pow(p, shr)
+    if p == 2:
+        # the digits are bits, so just let int() read them in binary. the
+        # repeating digits start at the 2^rpt place.
+        a = int("0" + "".join(map(str, reversed(seq[:rpt]))), 2)
+        c = int("".join(map(str, reversed(seq[rpt:]))), 2) << rpt
+        d = (1 << (len(seq) - rpt)) - 1 # d = p^t - 1
+        e = d << shr # e = (p^t - 1) * p^shr
+    else:
+        # accumulate the non-repeating digits into an integer "a". going from
+        # the most significant digit down (Horner's method) means we never
+        # hold more than the one running value, rather than a power of p for
+        # every digit.
+        a = 0
+        for i in reversed(seq[:rpt]):
+            a = a * p + i
+        # for the repeating digits, we can use the geometric series formula:
+        #   c + c * r + c * r^2 ... = c / (1 - r).
+        # if the repeating part repeats with period t, and has a value of c in
+        # the first iteration, then it's equal to
+        #   c + c * p^t + c * p^2t ...
+        # so we apply the geometric series formula with c = c and r = p^t to get
+        #   c / (1 - p^t).
+        # the repeating digits start at the p^rpt place.
+        c = 0
+        for i in reversed(seq[rpt:]):
+            c = c * p + i
+        c *= pow(p, rpt)
+        d = pow(p, len(seq) - rpt) - 1 # d = p^t - 1
+        e = d * pow(p, shr) # e = (p^t - 1) * p^shr
+    return a * d - c, e
 
 def simplify_rational(rat):
     n, d = rat
@@ -133,28 +238,58 @@ def simplify_rational(rat):
 
 def simplify_padic(padic):
     seq, rpt, shr = padic
-    # t is the number of trailing zeroes past the dot symbol
-    t = next((i for (i, d) in enumerate(seq[:shr]) if d != 0), min(len(seq), shr))
+    # t is the number of trailing zeroes past the dot symbol. for a bytearray
+    # lstrip finds them without a python loop.
+    if isinstance(seq, bytearray):
+        head = seq[:shr]
+        t = len(head) - len(head.lstrip(b"\0"))
+    else:
+        t = next((i for (i, d) in enumerate(seq[:shr]) if d != 0), min(len(seq), shr))
     if t == len(seq): # all zeroes
-        return [0], 0, 0
-    seq, rpt, shr = seq[t:], rpt - t, shr - t
+        return seq[:1], 0, 0
+    if t > rpt:
+        # the zeroes reach into the repeated part. dropping its first k digits
+        # leaves the same digits repeating from a different starting point, so
+        # rotate the repeated part and there is nothing left before it.
+        k = t - rpt
+        rep = seq[rpt:]
+        seq, rpt, shr = rep[k:] + rep[:k], 0, shr - t
+    else:
+        seq, rpt, shr = seq[t:], rpt - t, shr - t
     # shift the repeated part as far to the right as possible by merging in the
-    # non-repeated digits if they match up.
-    while rpt > 0 and seq[rpt - 1] == seq[-1]:
-        rpt -= 1
-        seq.pop()
-    # check if the repeated part actually has a smaller period
-    for i in range(1, (len(seq) - rpt) // 2 + 1):
-        # if i divides the period...
-        if (len(seq) - rpt) % i == 0:
-            # is the repeated part periodic with period i?
-            if all(seq[j] == seq[j-i] for j in range(rpt + i, len(seq))):
-                # if so, then truncate it!
-                seq = seq[:rpt+i]
-                # since we iterate the factors of the period in ascending
-                # order, all periods less than i have already been checked, so
-                # we can eagerly break the loop.
-                break
+    # non-repeated digits if they match up. count how many match first, then
+    # drop them all in one go.
+    m = 0
+    while m < rpt and seq[rpt - 1 - m] == seq[-1 - m]:
+        m += 1
+    if m:
+        rpt -= m
+        del seq[-m:]
+    # check if the repeated part actually has a smaller period.
+    rep = seq[rpt:]
+    if isinstance(seq, bytearray):
+        # the smallest period of rep is the first place where rep shows up
+        # again inside rep + rep. that's a single substring search.
+        seq = seq[:rpt + (rep + rep).find(rep, 1)]
+        return seq, rpt, shr
+    # only the divisors of the period t can be smaller periods, so find those
+    # by trial division up to sqrt(t) and try them in ascending order.
+    t = len(rep)
+    small, large = [], []
+    for i in range(1, math.isqrt(t) + 1):
+        if t % i == 0:
+            small.append(i)
+            if i != t // i:
+                large.append(t // i)
+    for i in small + large[:0:-1]:
+        # the repeated part is periodic with period i exactly when it matches
+        # itself shifted by i digits. comparing the slices is done in one go
+        # instead of digit by digit.
+        if rep[:t - i] == rep[i:]:
+            # if so, then truncate it! since we try the divisors in ascending
+            # order, all periods less than i have already been checked.
+            seq = seq[:rpt+i]
+            break
     return seq, rpt, shr
 
 def str_from_rational(rat):
@@ -164,62 +299,89 @@ def str_from_rational(rat):
     else:
         return f"{n}/{d}"
 
-def str_from_padic(padic):
+def str_from_padic(padic, p):
     seq, rpt, shr = padic
-    if max(seq) >= len(syms):
+    # every digit is in [0, p), so we know up front whether there are enough
+    # symbols without looking at the digits.
+    if p > len(syms):
         return "{not enough symbols to represent this number}"
+    # each run of digits is collected into bytes, reversed so that the most
+    # significant digit comes first, and turned into symbols with one
+    # translate call.
+    sym_bytes = lambda digs: bytes(digs)[::-1].translate(sym_table)
+    rep = seq[rpt:]
     # in the repeating part, we want to print exactly len(seq) - rpt digits.
     # we want the last digit to be max(shr, rpt) because we don't want to print
-    # the non-repeating digits or the digits right of the dot symbol here.
-    s = "("
-    for i in range((max(shr - rpt, 0) + len(seq)) - 1, max(shr, rpt) - 1, -1):
-        s += syms[seq[rpt + ((i - rpt) % (len(seq) - rpt))]]
-    s += ")"
+    # the non-repeating digits or the digits right of the dot symbol here, so
+    # rotate the repeated part to start there.
+    k = (max(shr, rpt) - rpt) % len(rep)
+    parts = [b"(", sym_bytes(rep[k:] + rep[:k]), b")"]
     # we can print the non-repeating digits left of the dot symbol, if any
-    for i in range(max(shr, rpt) - 1, shr - 1, -1):
-        s += syms[seq[i]]
+    parts.append(sym_bytes(seq[shr:max(shr, rpt)]))
     if shr:
         # we can print the symbols to the right of the dot symbol.
         # these might not all be present in seq if seq is simplified.
         # for example: 1/16 with p=2 is stored as seq=[1, 0], rpt=1, shr=4.
-        s += "."
-        for i in range(shr - 1, min(shr, rpt) - 1, -1):
-            s += syms[seq[rpt + ((i - rpt) % (len(seq) - rpt))]]
-        for i in range(min(shr, rpt) - 1, -1, -1):
-            s += syms[seq[i]]
-    return s
+        parts.append(b".")
+        frac = itertools.islice(itertools.cycle(rep), max(shr - rpt, 0))
+        parts.append(sym_bytes(itertools.chain(seq[:min(shr, rpt)], frac)))
+    return b"".join(parts).decode("ascii")
+
+def padic_digits(padic, pad, n):
+    # the first n digits of a padic after "pad" leading zeroes, as a flat seq
+    # with the repeated part copied out as many times as needed. this lets the
+    # caller index or map over the digits with no wrap-around checks.
+    seq, rpt, _ = padic
+    rep = seq[rpt:]
+    digs = bytearray(pad) if isinstance(seq, bytearray) else [0] * pad
+    digs += seq[:rpt]
+    digs += rep * (max(n - len(digs), 0) // len(rep) + 1)
+    del digs[n:]
+    return digs
 
 def padic_digitwise_op(op, padic_a, padic_b):
-    seen = {}
-    seq = []
     seq_a, rpt_a, shr_a = padic_a
     seq_b, rpt_b, shr_b = padic_b
-    # idx_a and idx_b are indices in seq_a and seq_b. we need to start with the
-    # logical digit position corresponding to the larger shr value. for example
-    # if shr_a = 5 and shr_b = 3, we start with idx_a = 0 and idx_b = -2.
-    idx_a, idx_b = min(0, shr_a - shr_b), min(0, shr_b - shr_a)
-    # the repetition state that we need to track is the pair (idx_a, idx_b). if
-    # these indices repeat, then the future outcomes will be the same.
-    while (idx_a, idx_b) not in seen:
-        seen[idx_a, idx_b] = len(seq)
-        # get the current logical digit from both sequences. a negative index
-        # means that other sequence had a larger shr value, we can just use
-        # zero.
-        dig_a = seq_a[idx_a] if idx_a >= 0 else 0
-        dig_b = seq_b[idx_b] if idx_b >= 0 else 0
-        # apply the op. the first digit in the resulting seq is in the logical
-        # -max(shr_a, shr_b) position.
-        seq.append(op(dig_a, dig_b))
-        # advance the logical indices, repeating if necessary.
-        idx_a += 1
-        idx_b += 1
-        if idx_a == len(seq_a):
-            idx_a = rpt_a
-        if idx_b == len(seq_b):
-            idx_b = rpt_b
-    return seq, seen[idx_a, idx_b], max(shr_a, shr_b)
-
-sum_op = lambda p: lambda a, b: (a + b) % p
+    # pad_a and pad_b are the number of zeroes to feed in front of seq_a and
+    # seq_b. we need to start with the logical digit position corresponding to
+    # the larger shr value. for example if shr_a = 5 and shr_b = 3, we start
+    # with pad_a = 0 and pad_b = 2. the first digit in the resulting seq is in
+    # the logical -max(shr_a, shr_b) position.
+    pad_a, pad_b = max(0, shr_b - shr_a), max(0, shr_a - shr_b)
+    # the repetition state is the pair of positions in seq_a and seq_b. each
+    # position on its own starts repeating with period len(seq) - rpt once it
+    # has gone through the padding and the non-repeating digits, and not a
+    # moment before. so the pair starts repeating once both of them do, and
+    # the period is the lcm of the two periods. no need to look for it.
+    rpt = max(pad_a + rpt_a, pad_b + rpt_b)
+    period = math.lcm(len(seq_a) - rpt_a, len(seq_b) - rpt_b)
+    digs_a = padic_digits(padic_a, pad_a, rpt + period)
+    digs_b = padic_digits(padic_b, pad_b, rpt + period)
+    # the digits of the result are in [0, p) too, so keep the same kind of
+    # sequence as the inputs. ops made by sum_op come with a "kernel" that
+    # runs the whole loop without a function call per digit.
+    kernel = getattr(op, "kernel", None)
+    if kernel:
+        seq = kernel(digs_a, digs_b)
+    else:
+        seq = type(digs_a)(map(op, digs_a, digs_b))
+    return seq, rpt, max(shr_a, shr_b)
+
+@functools.lru_cache(maxsize=None)
+def sum_op(p):
+    # for p = 2 the digit-wise sum is XOR. operator.xor is a builtin, so the
+    # map() in padic_digitwise_op calls it without running any python code per
+    # digit.
+    if p == 2:
+        return operator.xor
+    def op(a, b):
+        return (a + b) % p
+    # "kernel" does the whole digit loop of padic_digitwise_op in one list
+    # comprehension instead of calling op once per digit.
+    def kernel(digs_a, digs_b):
+        return type(digs_a)([(a + b) % p for a, b in zip(digs_a, digs_b)])
+    op.kernel = kernel
+    return op
 
 if __name__ == "__main__":
     import sys
@@ -239,7 +401,7 @@ if __name__ == "__main__":
     padic_dws = padic_digitwise_op(sum_op(p), padic_a, padic_b)
     padic_dws = simplify_padic(padic_dws)
     rat_dws = simplify_rational(rational_from_padic(padic_dws, p))
-    print(f"A is {str_from_rational(rat_a)}; as a {p}-adic, that's {str_from_padic(padic_a)}")
-    print(f"B is {str_from_rational(rat_b)}; as a {p}-adic, that's {str_from_padic(padic_b)}")
-    print(f"The digit-wise sum A ⨁ B is {str_from_padic(padic_dws)}")
+    print(f"A is {str_from_rational(rat_a)}; as a {p}-adic, that's {str_from_padic(padic_a, p)}")
+    print(f"B is {str_from_rational(rat_b)}; as a {p}-adic, that's {str_from_padic(padic_b, p)}")
+    print(f"The digit-wise sum A ⨁ B is {str_from_padic(padic_dws, p)}")
     print(f"As a ratio, A ⨁ B is {str_from_rational(rat_dws)}")